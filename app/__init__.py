@@ -31,6 +31,11 @@ babel = Babel()
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'],
+            pool_size=app.config['DATABASE_POOL_SIZE'],
+            max_overflow=app.config['DATABASE_MAX_OVERFLOW'])
 
     db.init_app(app)
     migrate.init_app(app, db)
@@ -1,6 +1,7 @@
 import sqlalchemy as sa
 from flask import request, url_for, abort
 from app import db
+from app.cache import EXPLORE_CACHE_KEY, delete_cached
 from app.models import User
 from app.api import bp
 from app.api.auth import token_auth
@@ -76,6 +77,11 @@ def update_user(id):
         db.session.scalar(sa.select(User).where(
             User.email == data['email'])):
         return bad_request('please use a different email address')
+    renamed = data.get('username', user.username) != user.username or \
+        data.get('email', user.email) != user.email
     user.from_dict(data, new_user=False)
     db.session.commit()
+    if renamed:
+        # the cached explore page shows the author's name and avatar
+        delete_cached(EXPLORE_CACHE_KEY)
     return user.to_dict()
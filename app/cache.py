@@ -0,0 +1,27 @@
+import json
+import redis
+from flask import current_app
+
+EXPLORE_CACHE_KEY = 'explore:first_page'
+
+
+def get_cached(key):
+    try:
+        payload = current_app.redis.get(key)
+    except redis.exceptions.RedisError:
+        return None
+    return json.loads(payload) if payload is not None else None
+
+
+def set_cached(key, value, timeout):
+    try:
+        current_app.redis.setex(key, timeout, json.dumps(value))
+    except redis.exceptions.RedisError:
+        pass
+
+
+def delete_cached(*keys):
+    try:
+        current_app.redis.delete(*keys)
+    except redis.exceptions.RedisError:
+        pass
@@ -1,4 +1,8 @@
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
+import functools
+import hashlib
+from time import time
+import uuid
 from flask import (
     render_template,
     flash,
@@ -7,39 +11,125 @@ from flask import (
     request,
     g,
     current_app,
-    send_file,
+    session,
+    make_response,
+    send_from_directory,
 )
 from flask_login import current_user, login_required
 from flask_babel import _, get_locale
 import sqlalchemy as sa
-from langdetect import detect, LangDetectException
+import sqlalchemy.orm as so
+import orjson
+import redis
 from app import db
+from app.cache import EXPLORE_CACHE_KEY, get_cached, set_cached, delete_cached
 from app.main.forms import EditProfileForm, EmptyForm, PostForm, SearchForm, MessageForm
 from app.models import User, Post, Message, Notification
-from app.translate import translate
+from app.presence import record_last_seen
+from app.timeline import add_to_timelines, get_timeline_page, remove_timeline
+from app.translate import translate, detect_language
 from app.main import bp
 
-from opentimestamps.core.timestamp import DetachedTimestampFile
-from opentimestamps.core.op import OpAppend
-
+from werkzeug.local import LocalProxy
 from werkzeug.utils import secure_filename
 import os
 
 ALLOWED_EXTENSIONS = {"pdf", "txt", "docx", "jpg"}
+CHUNK_SIZE = 1 << 20
 
 
 # Check allowed file extension
 def allowed_file(filename):
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+    _, dot, extension = filename.rpartition(".")
+    return bool(dot) and extension.lower() in ALLOWED_EXTENSIONS
+
+
+# templates only resolve the locale when they actually render it
+current_locale = LocalProxy(lambda: str(get_locale()))
+bp.add_app_template_global(current_locale, "current_locale")
+
+
+def _json_response(data):
+    return current_app.response_class(orjson.dumps(data), mimetype="application/json")
+
+
+def _etag(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def _page_etag(*parts):
+    """ETag of a full page, which also depends on the user's navigation bar."""
+    # the navigation bar shows the progress of running tasks
+    tasks = [
+        (task.id, task.get_progress()) for task in current_user.get_tasks_in_progress()
+    ]
+    return _etag(
+        parts,
+        current_user.id,
+        current_user.username,
+        current_user.unread_count,
+        tasks,
+        str(get_locale()),
+    )
+
+
+def _csrf_version():
+    # CSRF tokens are tied to the session and expire, so cached forms must too
+    time_limit = current_app.config.get("WTF_CSRF_TIME_LIMIT", 3600) or 3600
+    return session.get("csrf_token"), int(time() // time_limit)
+
+
+def _not_modified(etag):
+    """Return a 304 response if the client already has this version."""
+    if "_flashes" in session or not request.if_none_match.contains(etag):
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def _with_etag(body, etag):
+    response = make_response(body)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def _page_cursors():
+    """Read the ``before``/``after`` keyset cursors from the query string."""
+    id = request.args.get("id", type=int)
+    if id is None:
+        return None, None
+    before = request.args.get("before", type=datetime.fromisoformat)
+    after = request.args.get("after", type=datetime.fromisoformat)
+    return (
+        (before, id) if before is not None else None,
+        (after, id) if after is not None else None,
+    )
+
+
+def _before(cursor):
+    timestamp, id = cursor
+    return {"before": timestamp.isoformat(), "id": id}
+
+
+def _after(cursor):
+    timestamp, id = cursor
+    return {"after": timestamp.isoformat(), "id": id}
 
 
 @bp.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.now(timezone.utc)
-        db.session.commit()
-        g.search_form = SearchForm()
-    g.locale = str(get_locale())
+        now = datetime.now(timezone.utc)
+        interval = timedelta(seconds=current_app.config["LAST_SEEN_UPDATE_INTERVAL"])
+        last_seen = current_user.last_seen
+        if last_seen is None or now - last_seen.replace(tzinfo=timezone.utc) > interval:
+            record_last_seen(current_user.id, now)
+        # the search form is only built the first time a view or template uses it
+        g.search_form = LocalProxy(functools.cache(SearchForm))
+    g.per_page = current_app.config["POSTS_PER_PAGE"]
 
 
 @bp.route("/", methods=["GET", "POST"])
@@ -48,29 +138,39 @@ def before_request():
 def index():
     form = PostForm()
     if form.validate_on_submit():
-        try:
-            language = detect(form.post.data)
-        except LangDetectException:
-            language = ""
-        post = Post(body=form.post.data, author=current_user, language=language)
+        post = Post(body=form.post.data, author=current_user, language="")
         db.session.add(post)
         db.session.commit()
+        delete_cached(EXPLORE_CACHE_KEY)
+        add_to_timelines(post, [current_user.id])
+        try:
+            current_app.task_queue.enqueue("app.tasks.detect_post_language", post.id)
+            current_app.task_queue.enqueue("app.tasks.fan_out_post", post.id)
+        except redis.exceptions.RedisError:
+            # without a task queue the language is detected in the request
+            post.language = detect_language(post.body)
+            db.session.commit()
         flash(_("Your post is now live!"))
         return redirect(url_for("main.index"))
-    page = request.args.get("page", 1, type=int)
-    posts = db.paginate(
-        current_user.following_posts(),
-        page=page,
-        per_page=current_app.config["POSTS_PER_PAGE"],
-        error_out=False,
-    )
-    next_url = url_for("main.index", page=posts.next_num) if posts.has_next else None
-    prev_url = url_for("main.index", page=posts.prev_num) if posts.has_prev else None
+    before, after = _page_cursors()
+    page = None
+    if after is None:
+        page = get_timeline_page(current_user, g.per_page, before)
+    if page is None:
+        page = Post.keyset_paginate(
+            current_user.following_posts(),
+            g.per_page,
+            before,
+            after,
+        )
+    posts, next_cursor, prev_cursor = page
+    next_url = url_for("main.index", **_before(next_cursor)) if next_cursor else None
+    prev_url = url_for("main.index", **_after(prev_cursor)) if prev_cursor else None
     return render_template(
         "index.html",
         title=_("Home"),
         form=form,
-        posts=posts.items,
+        posts=posts,
         next_url=next_url,
         prev_url=prev_url,
     )
@@ -79,46 +179,96 @@ def index():
 @bp.route("/explore")
 @login_required
 def explore():
-    page = request.args.get("page", 1, type=int)
-    query = sa.select(Post).order_by(Post.timestamp.desc())
-    posts = db.paginate(
-        query, page=page, per_page=current_app.config["POSTS_PER_PAGE"], error_out=False
+    before, after = _page_cursors()
+    if before is None and after is None:
+        version, next_cursor, posts = _explore_first_page()
+        prev_cursor = None
+    else:
+        posts, next_cursor, prev_cursor = Post.keyset_paginate(
+            sa.select(Post).options(so.selectinload(Post.author)),
+            g.per_page,
+            before,
+            after,
+        )
+        version = _explore_version(posts)
+    etag = _page_etag(version, next_cursor, prev_cursor)
+    response = _not_modified(etag)
+    if response is not None:
+        return response
+    if posts is None:
+        posts = Post.get_many([entry[0] for entry in version])
+    next_url = url_for("main.explore", **_before(next_cursor)) if next_cursor else None
+    prev_url = url_for("main.explore", **_after(prev_cursor)) if prev_cursor else None
+    return _with_etag(
+        render_template(
+            "index.html",
+            title=_("Explore"),
+            posts=posts,
+            next_url=next_url,
+            prev_url=prev_url,
+        ),
+        etag,
     )
-    next_url = url_for("main.explore", page=posts.next_num) if posts.has_next else None
-    prev_url = url_for("main.explore", page=posts.prev_num) if posts.has_prev else None
-    return render_template(
-        "index.html",
-        title=_("Explore"),
-        posts=posts.items,
-        next_url=next_url,
-        prev_url=prev_url,
+
+
+def _explore_version(posts):
+    # everything the posts render, including the author links and avatar
+    return [
+        [post.id, post.language, post.author.username, post.author.avatar(70)]
+        for post in posts
+    ]
+
+
+def _explore_first_page():
+    # the first explore page is the same for everyone, so it is cached
+    cached = get_cached(EXPLORE_CACHE_KEY)
+    if cached is not None and "posts" in cached:
+        next_cursor = cached["next"]
+        if next_cursor is not None:
+            next_cursor = (datetime.fromisoformat(next_cursor[0]), next_cursor[1])
+        return cached["posts"], next_cursor, None
+    posts, next_cursor, prev_cursor = Post.keyset_paginate(
+        sa.select(Post).options(so.selectinload(Post.author)),
+        g.per_page,
+    )
+    version = _explore_version(posts)
+    set_cached(
+        EXPLORE_CACHE_KEY,
+        {
+            "posts": version,
+            "next": (
+                (next_cursor[0].isoformat(), next_cursor[1]) if next_cursor else None
+            ),
+        },
+        current_app.config["EXPLORE_CACHE_TIMEOUT"],
     )
+    return version, next_cursor, posts
 
 
 @bp.route("/user/<username>")
 @login_required
 def user(username):
     user = db.first_or_404(sa.select(User).where(User.username == username))
-    page = request.args.get("page", 1, type=int)
-    query = user.posts.select().order_by(Post.timestamp.desc())
-    posts = db.paginate(
-        query, page=page, per_page=current_app.config["POSTS_PER_PAGE"], error_out=False
+    posts, next_cursor, prev_cursor = Post.keyset_paginate(
+        user.posts.select().options(so.selectinload(Post.author)),
+        g.per_page,
+        *_page_cursors(),
     )
     next_url = (
-        url_for("main.user", username=user.username, page=posts.next_num)
-        if posts.has_next
+        url_for("main.user", username=user.username, **_before(next_cursor))
+        if next_cursor
         else None
     )
     prev_url = (
-        url_for("main.user", username=user.username, page=posts.prev_num)
-        if posts.has_prev
+        url_for("main.user", username=user.username, **_after(prev_cursor))
+        if prev_cursor
         else None
     )
     form = EmptyForm()
     return render_template(
         "user.html",
         user=user,
-        posts=posts.items,
+        posts=posts,
         next_url=next_url,
         prev_url=prev_url,
         form=form,
@@ -129,8 +279,39 @@ def user(username):
 @login_required
 def user_popup(username):
     user = db.first_or_404(sa.select(User).where(User.username == username))
+    # the counts and the follow state still have to be queried to build the
+    # ETag, a 304 only saves rendering the popup and sending it again
+    followers_count = user.followers_count()
+    following_count = user.following_count()
+    is_following = user != current_user and current_user.is_following(user)
+    etag = _etag(
+        user.id,
+        user.username,
+        user.avatar(64),
+        user.about_me,
+        user.last_seen,
+        followers_count,
+        following_count,
+        current_user.id,
+        is_following,
+        str(get_locale()),
+        _csrf_version(),
+    )
+    response = _not_modified(etag)
+    if response is not None:
+        return response
     form = EmptyForm()
-    return render_template("user_popup.html", user=user, form=form)
+    return _with_etag(
+        render_template(
+            "user_popup.html",
+            user=user,
+            followers_count=followers_count,
+            following_count=following_count,
+            is_following=is_following,
+            form=form,
+        ),
+        etag,
+    )
 
 
 @bp.route("/edit_profile", methods=["GET", "POST"])
@@ -138,9 +319,13 @@ def user_popup(username):
 def edit_profile():
     form = EditProfileForm(current_user.username)
     if form.validate_on_submit():
+        renamed = form.username.data != current_user.username
         current_user.username = form.username.data
         current_user.about_me = form.about_me.data
         db.session.commit()
+        if renamed:
+            # the cached explore page links to posts by their author's name
+            delete_cached(EXPLORE_CACHE_KEY)
         flash(_("Your changes have been saved."))
         return redirect(url_for("main.edit_profile"))
     elif request.method == "GET":
@@ -149,20 +334,24 @@ def edit_profile():
     return render_template("edit_profile.html", title=_("Edit Profile"), form=form)
 
 
+def _user_id(username):
+    return db.session.scalar(sa.select(User.id).where(User.username == username))
+
+
 @bp.route("/follow/<username>", methods=["POST"])
 @login_required
 def follow(username):
     form = EmptyForm()
     if form.validate_on_submit():
-        user = db.session.scalar(sa.select(User).where(User.username == username))
-        if user is None:
-            flash(_("User %(username)s not found.", username=username))
-            return redirect(url_for("main.index"))
-        if user == current_user:
+        if username == current_user.username:
             flash(_("You cannot follow yourself!"))
             return redirect(url_for("main.user", username=username))
-        current_user.follow(user)
-        db.session.commit()
+        if current_user.follow_username(username):
+            db.session.commit()
+            remove_timeline(current_user.id)
+        elif _user_id(username) is None:
+            flash(_("User %(username)s not found.", username=username))
+            return redirect(url_for("main.index"))
         flash(_("You are following %(username)s!", username=username))
         return redirect(url_for("main.user", username=username))
     else:
@@ -174,15 +363,15 @@ def follow(username):
 def unfollow(username):
     form = EmptyForm()
     if form.validate_on_submit():
-        user = db.session.scalar(sa.select(User).where(User.username == username))
-        if user is None:
-            flash(_("User %(username)s not found.", username=username))
-            return redirect(url_for("main.index"))
-        if user == current_user:
+        if username == current_user.username:
             flash(_("You cannot unfollow yourself!"))
             return redirect(url_for("main.user", username=username))
-        current_user.unfollow(user)
-        db.session.commit()
+        if current_user.unfollow_username(username):
+            db.session.commit()
+            remove_timeline(current_user.id)
+        elif _user_id(username) is None:
+            flash(_("User %(username)s not found.", username=username))
+            return redirect(url_for("main.index"))
         flash(_("You are not following %(username)s.", username=username))
         return redirect(url_for("main.user", username=username))
     else:
@@ -193,9 +382,13 @@ def unfollow(username):
 @login_required
 def translate_text():
     data = request.get_json()
-    return {
-        "text": translate(data["text"], data["source_language"], data["dest_language"])
-    }
+    return _json_response(
+        {
+            "text": translate(
+                data["text"], data["source_language"], data["dest_language"]
+            )
+        }
+    )
 
 
 @bp.route("/search")
@@ -203,13 +396,12 @@ def translate_text():
 def search():
     if not g.search_form.validate():
         return redirect(url_for("main.explore"))
-    page = request.args.get("page", 1, type=int)
-    posts, total = Post.search(
-        g.search_form.q.data, page, current_app.config["POSTS_PER_PAGE"]
-    )
+    page = max(request.args.get("page", 1, type=int), 1)
+    posts, total = Post.search(g.search_form.q.data, page, g.per_page)
+    shown = page * g.per_page
     next_url = (
         url_for("main.search", q=g.search_form.q.data, page=page + 1)
-        if total > page * current_app.config["POSTS_PER_PAGE"]
+        if total > shown
         else None
     )
     prev_url = (
@@ -234,7 +426,9 @@ def send_message(recipient):
     if form.validate_on_submit():
         msg = Message(author=current_user, recipient=user, body=form.message.data)
         db.session.add(msg)
-        user.add_notification("unread_message_count", user.unread_message_count())
+        user.unread_count = User.unread_count + 1
+        db.session.flush()
+        user.add_notification("unread_message_count", user.unread_count)
         db.session.commit()
         flash(_("Your message has been sent."))
         return redirect(url_for("main.user", username=recipient))
@@ -247,21 +441,20 @@ def send_message(recipient):
 @login_required
 def messages():
     current_user.last_message_read_time = datetime.now(timezone.utc)
+    current_user.unread_count = 0
     current_user.add_notification("unread_message_count", 0)
     db.session.commit()
-    page = request.args.get("page", 1, type=int)
-    query = current_user.messages_received.select().order_by(Message.timestamp.desc())
-    messages = db.paginate(
-        query, page=page, per_page=current_app.config["POSTS_PER_PAGE"], error_out=False
-    )
-    next_url = (
-        url_for("main.messages", page=messages.next_num) if messages.has_next else None
-    )
-    prev_url = (
-        url_for("main.messages", page=messages.prev_num) if messages.has_prev else None
+    messages, next_cursor, prev_cursor = Message.keyset_paginate(
+        current_user.messages_received.select().options(
+            so.selectinload(Message.author)
+        ),
+        g.per_page,
+        *_page_cursors(),
     )
+    next_url = url_for("main.messages", **_before(next_cursor)) if next_cursor else None
+    prev_url = url_for("main.messages", **_after(prev_cursor)) if prev_cursor else None
     return render_template(
-        "messages.html", messages=messages.items, next_url=next_url, prev_url=prev_url
+        "messages.html", messages=messages, next_url=next_url, prev_url=prev_url
     )
 
 
@@ -284,129 +477,98 @@ def notifications():
         current_user.notifications.select()
         .where(Notification.timestamp > since)
         .order_by(Notification.timestamp.asc())
+        .limit(100)
     )
     notifications = db.session.scalars(query)
-    return [
-        {"name": n.name, "data": n.get_data(), "timestamp": n.timestamp}
-        for n in notifications
-    ]
-
-
-import tempfile
-
-
-# @bp.route("/stamp", methods=["GET", "POST"])
-# @login_required
-# def stamp():
-#     if request.method == "POST":
-#         if "file" not in request.files:
-#             flash("No file part")
-#             return redirect(request.url)
-
-#         file = request.files["file"]
-#         if file.filename == "":
-#             flash("No selected file")
-#             return redirect(request.url)
-
-#         if file and allowed_file(file.filename):
-#             filename = secure_filename(file.filename)
-
-#             # Use a temporary directory
-#             with tempfile.TemporaryDirectory() as temp_dir:
-#                 file_path = os.path.join(temp_dir, filename)
-#                 file.save(file_path)
-
-#                 ots_file_path = file_path + ".ots"
-
-#                 try:
-#                     # Create a DetachedTimestampFile and apply an operation
-#                     with open(file_path, "rb") as f:
-#                         file_bytes = f.read()
-
-#                     detached_timestamp = DetachedTimestampFile()
-#                     detached_timestamp.file_bytes = file_bytes
-#                     detached_timestamp.ops.append(OpAppend())
-
-#                     # Serialize the timestamp
-#                     timestamp_bytes = detached_timestamp.serialize()
-
-#                     # Save the .ots file
-#                     with open(ots_file_path, "wb") as f:
-#                         f.write(timestamp_bytes)
-
-#                     flash(
-#                         "File stamped successfully! You can download the OTS file below."
-#                     )
-#                     return send_file(ots_file_path, as_attachment=True)
-
-#                 except Exception as e:
-#                     flash(f"Error stamping the file: {str(e)}")
-#                     return redirect(request.url)
-
-#     return render_template("stamp.html")
-
-from flask import Flask, render_template, request, flash, send_file
-from werkzeug.utils import secure_filename
-import os
-
-from opentimestamps.core.timestamp import Timestamp
-from opentimestamps.core.op import OpSHA256
-from opentimestamps.core.timestamp import DetachedTimestampFile
-
-
-# Function to stamp the file using OpenTimestamps
-def stamp_file(file_path):
-    try:
-        # Open the file and create a SHA256 hash of the file contents
-        with open(file_path, "rb") as f:
-            file_hash_op = OpSHA256()
-            timestamp = Timestamp(f.read())
-
-        # Create a DetachedTimestampFile with the timestamp
-        detached_timestamp = DetachedTimestampFile(file_hash_op, timestamp)
-
-        # Define the file path for the timestamp .ots file
-        timestamp_file_path = file_path + ".ots"
-
-        # Save the timestamp to a file
-        with open(timestamp_file_path, "wb") as f:
-            detached_timestamp.serialize(f)
+    return _json_response(
+        [
+            {"name": n.name, "data": n.get_data(), "timestamp": n.timestamp}
+            for n in notifications
+        ]
+    )
 
-        return timestamp_file_path
 
-    except Exception as e:
-        flash(f"Error stamping the file: {str(e)}")
+def _stamp_folder():
+    return os.path.join(current_app.config["STAMP_FOLDER"], str(current_user.id))
 
 
-# Flask route for file stamping
 @bp.route("/stamp", methods=["GET", "POST"])
+@login_required
 def stamp():
     if request.method == "POST":
         if "file" not in request.files:
-            flash("No file part")
+            flash(_("No file part"))
             return redirect(request.url)
 
         file = request.files["file"]
-        if file.filename == "":
-            flash("No selected file")
+        filename = secure_filename(file.filename)
+        if filename == "":
+            flash(_("No selected file"))
+            return redirect(request.url)
+        if not allowed_file(filename):
+            flash(_("File type not allowed"))
             return redirect(request.url)
 
-        if file:
-            # Use tempfile to create a temporary directory
-            with tempfile.TemporaryDirectory() as temp_dir:
-                # Create a valid file path by joining the temp directory with the secure filename
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(temp_dir, filename)
-                file.save(file_path)
-
-                # Call the function to stamp the file
-                stamped_file_path = stamp_file(file_path)
-
-                if stamped_file_path:
-                    return send_file(stamped_file_path, as_attachment=True)
-                else:
-                    flash("Error stamping the file.")
-                    return redirect(request.url)
-
-    # Ensure the route always renders the template for GET requests or after POST if no errors
-    return render_template("stamp.html")
+        # Stamping runs in the task queue, the upload is kept in a folder that
+        # is shared with the workers until it has been hashed
+        os.makedirs(_stamp_folder(), exist_ok=True)
+        # a unique prefix keeps uploads with the same name from replacing
+        # each other before they are stamped
+        file_path = os.path.join(_stamp_folder(), f"{uuid.uuid4().hex}_{filename}")
+        file.save(file_path, buffer_size=CHUNK_SIZE)
+        # if the task cannot be started nothing else will remove the upload
+        try:
+            current_user.launch_task("stamp_file", _("Stamping document..."), file_path)
+            db.session.commit()
+        except redis.exceptions.RedisError:
+            os.remove(file_path)
+            db.session.rollback()
+            flash(_("Stamping is not available right now, please try again later."))
+            return redirect(url_for("main.stamp"))
+        except Exception:
+            os.remove(file_path)
+            raise
+        flash(
+            _("Your file is being stamped, it will be listed below when it is ready.")
+        )
+        return redirect(url_for("main.stamp"))
+
+    failed = db.session.scalars(
+        current_user.notifications.select()
+        .where(Notification.name.startswith("stamp_failed:"))
+        .order_by(Notification.timestamp.asc())
+    ).all()
+    for notification in failed:
+        flash(
+            _(
+                "Your file %(filename)s could not be stamped.",
+                filename=notification.get_data()["filename"],
+            )
+        )
+        db.session.delete(notification)
+    if failed:
+        db.session.commit()
+    stamps = []
+    if os.path.isdir(_stamp_folder()):
+        # finished stamps are only kept for STAMP_TIMEOUT seconds
+        expired = time() - current_app.config["STAMP_TIMEOUT"]
+        for f in os.listdir(_stamp_folder()):
+            if not f.endswith(".ots"):
+                continue
+            path = os.path.join(_stamp_folder(), f)
+            try:
+                if os.path.getmtime(path) < expired:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            stamps.append((f, f.partition("_")[2]))
+        stamps.sort(key=lambda stamp: stamp[1])
+    accept = ",".join("." + extension for extension in sorted(ALLOWED_EXTENSIONS))
+    return render_template("stamp.html", stamps=stamps, accept=accept)
+
+
+@bp.route("/stamp/<filename>")
+@login_required
+def download_stamp(filename):
+    return send_from_directory(_stamp_folder(), filename, as_attachment=True)
@@ -1,15 +1,16 @@
 from datetime import datetime, timezone, timedelta
 from hashlib import md5
-import json
 import secrets
 from time import time
 from typing import Optional
 import sqlalchemy as sa
 import sqlalchemy.orm as so
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from flask import current_app, url_for
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
+import orjson
 import redis
 import rq
 from app import db, login
@@ -19,16 +20,43 @@ from app.search import add_to_index, remove_from_index, query_index
 class SearchableMixin:
     @classmethod
     def search(cls, expression, page, per_page):
+        if current_app.elasticsearch is None and \
+                db.session.get_bind().dialect.name == 'postgresql':
+            return cls.search_fulltext(expression, page, per_page)
         ids, total = query_index(cls.__tablename__, expression, page, per_page)
         if total == 0:
             return [], 0
         when = []
         for i in range(len(ids)):
             when.append((ids[i], i))
-        query = sa.select(cls).where(cls.id.in_(ids)).order_by(
-            db.case(*when, value=cls.id))
+        query = sa.select(cls).where(cls.id.in_(ids)).options(
+            so.selectinload(cls.author)).order_by(
+                db.case(*when, value=cls.id))
         return db.session.scalars(query), total
 
+    @classmethod
+    def search_document(cls):
+        # must match the expression of the GIN index created in the migrations
+        text = getattr(cls, cls.__searchable__[0])
+        for field in cls.__searchable__[1:]:
+            text = text + ' ' + getattr(cls, field)
+        return sa.func.to_tsvector('english', text)
+
+    @classmethod
+    def search_fulltext(cls, expression, page, per_page):
+        document = cls.search_document()
+        query = sa.func.plainto_tsquery('english', expression)
+        rows = db.session.execute(
+            sa.select(cls, sa.func.count().over())
+            .options(so.selectinload(cls.author))
+            .where(document.bool_op('@@')(query))
+            .order_by(sa.func.ts_rank(document, query).desc(), cls.id.desc())
+            .limit(per_page)
+            .offset((page - 1) * per_page)).all()
+        if not rows:
+            return [], 0
+        return [row[0] for row in rows], rows[0][1]
+
     @classmethod
     def before_commit(cls, session):
         session._changes = {
@@ -85,13 +113,66 @@ class PaginatedAPIMixin(object):
         return data
 
 
+class KeysetPaginationMixin:
+    @classmethod
+    def keyset_paginate(cls, query, per_page, before=None, after=None):
+        # before and after are (timestamp, id) cursors of a neighbouring page
+        key = sa.tuple_(cls.timestamp, cls.id)
+        query = query.order_by(None)
+        if after is not None:
+            query = query.where(key > after).order_by(
+                cls.timestamp.asc(), cls.id.asc())
+        else:
+            if before is not None:
+                query = query.where(key < before)
+            query = query.order_by(cls.timestamp.desc(), cls.id.desc())
+        items = db.session.scalars(query.limit(per_page + 1)).all()
+        has_more = len(items) > per_page
+        items = items[:per_page]
+        if after is not None:
+            items.reverse()
+            has_next, has_prev = True, has_more
+        else:
+            has_next, has_prev = has_more, before is not None
+        if not items:
+            return items, None, None
+        next_cursor = (items[-1].timestamp, items[-1].id) if has_next else None
+        prev_cursor = (items[0].timestamp, items[0].id) if has_prev else None
+        return items, next_cursor, prev_cursor
+
+
+def insert_or_ignore(table):
+    """Return an INSERT for ``table`` that skips rows that already exist."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return sa.insert(table).prefix_with('IGNORE')
+
+
+def upsert(table, values, keys):
+    """Return an INSERT for ``table`` that updates the row with the same
+    ``keys`` instead when it already exists."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(table).values(values)
+        return stmt.on_duplicate_key_update(
+            {c: stmt.inserted[c] for c in values if c not in keys})
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    stmt = insert(table).values(values)
+    return stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={c: stmt.excluded[c] for c in values if c not in keys})
+
+
 followers = sa.Table(
     'followers',
     db.metadata,
     sa.Column('follower_id', sa.Integer, sa.ForeignKey('user.id'),
               primary_key=True),
     sa.Column('followed_id', sa.Integer, sa.ForeignKey('user.id'),
-              primary_key=True)
+              primary_key=True, index=True)
 )
 
 
@@ -106,6 +187,8 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
     last_seen: so.Mapped[Optional[datetime]] = so.mapped_column(
         default=lambda: datetime.now(timezone.utc))
     last_message_read_time: so.Mapped[Optional[datetime]]
+    unread_count: so.Mapped[int] = so.mapped_column(default=0,
+                                                    server_default='0')
     token: so.Mapped[Optional[str]] = so.mapped_column(
         sa.String(32), index=True, unique=True)
     token_expiration: so.Mapped[Optional[datetime]]
@@ -149,6 +232,23 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         if self.is_following(user):
             self.following.remove(user)
 
+    def follow_username(self, username):
+        """Follow a user by name, returns False if nothing changed."""
+        query = sa.select(sa.literal(self.id), User.id).where(
+            User.username == username)
+        result = db.session.execute(insert_or_ignore(followers).from_select(
+            ['follower_id', 'followed_id'], query))
+        return result.rowcount > 0
+
+    def unfollow_username(self, username):
+        """Unfollow a user by name, returns False if nothing changed."""
+        followed_id = sa.select(User.id).where(
+            User.username == username).scalar_subquery()
+        result = db.session.execute(followers.delete().where(
+            followers.c.follower_id == self.id,
+            followers.c.followed_id == followed_id))
+        return result.rowcount > 0
+
     def is_following(self, user):
         query = self.following.select().where(User.id == user.id)
         return db.session.scalar(query) is not None
@@ -176,6 +276,7 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
             ))
             .group_by(Post)
             .order_by(Post.timestamp.desc())
+            .options(so.selectinload(Post.author))
         )
 
     def get_reset_password_token(self, expires_in=600):
@@ -193,18 +294,15 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         return db.session.get(User, id)
 
     def unread_message_count(self):
-        last_read_time = self.last_message_read_time or datetime(1900, 1, 1)
-        query = sa.select(Message).where(Message.recipient == self,
-                                         Message.timestamp > last_read_time)
-        return db.session.scalar(sa.select(sa.func.count()).select_from(
-            query.subquery()))
+        return self.unread_count
 
     def add_notification(self, name, data):
-        db.session.execute(self.notifications.delete().where(
-            Notification.name == name))
-        n = Notification(name=name, payload_json=json.dumps(data), user=self)
-        db.session.add(n)
-        return n
+        db.session.execute(upsert(Notification.__table__, {
+            'user_id': self.id,
+            'name': name,
+            'payload_json': orjson.dumps(data).decode(),
+            'timestamp': time(),
+        }, ['user_id', 'name']))
 
     def launch_task(self, name, description, *args, **kwargs):
         rq_job = current_app.task_queue.enqueue(f'app.tasks.{name}', self.id,
@@ -284,12 +382,13 @@ def load_user(id):
     return db.session.get(User, int(id))
 
 
-class Post(SearchableMixin, db.Model):
+class Post(SearchableMixin, KeysetPaginationMixin, db.Model):
     __searchable__ = ['body']
+    __table_args__ = (sa.Index('ix_post_timestamp_id', 'timestamp', 'id'),)
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     body: so.Mapped[str] = so.mapped_column(sa.String(140))
     timestamp: so.Mapped[datetime] = so.mapped_column(
-        index=True, default=lambda: datetime.now(timezone.utc))
+        default=lambda: datetime.now(timezone.utc))
     user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id),
                                                index=True)
     language: so.Mapped[Optional[str]] = so.mapped_column(sa.String(5))
@@ -299,8 +398,19 @@ class Post(SearchableMixin, db.Model):
     def __repr__(self):
         return '<Post {}>'.format(self.body)
 
-
-class Message(db.Model):
+    @classmethod
+    def get_many(cls, ids):
+        if not ids:
+            return []
+        when = [(id, i) for i, id in enumerate(ids)]
+        query = sa.select(cls).where(cls.id.in_(ids)).options(
+            so.selectinload(cls.author)).order_by(
+                db.case(*when, value=cls.id)).options(so.selectinload(cls.author))
+        return db.session.scalars(query).all()
+
+
+class Message(KeysetPaginationMixin, db.Model):
+    __table_args__ = (sa.Index('ix_message_timestamp_id', 'timestamp', 'id'),)
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     sender_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id),
                                                  index=True)
@@ -308,7 +418,7 @@ class Message(db.Model):
                                                     index=True)
     body: so.Mapped[str] = so.mapped_column(sa.String(140))
     timestamp: so.Mapped[datetime] = so.mapped_column(
-        index=True, default=lambda: datetime.now(timezone.utc))
+        default=lambda: datetime.now(timezone.utc))
 
     author: so.Mapped[User] = so.relationship(
         foreign_keys='Message.sender_id',
@@ -322,17 +432,21 @@ class Message(db.Model):
 
 
 class Notification(db.Model):
+    __table_args__ = (
+        sa.Index('ix_notification_user_id_timestamp', 'user_id', 'timestamp'),
+        sa.Index('ix_notification_user_id_name', 'user_id', 'name',
+                 unique=True),
+    )
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     name: so.Mapped[str] = so.mapped_column(sa.String(128), index=True)
-    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id),
-                                               index=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id))
     timestamp: so.Mapped[float] = so.mapped_column(index=True, default=time)
     payload_json: so.Mapped[str] = so.mapped_column(sa.Text)
 
     user: so.Mapped[User] = so.relationship(back_populates='notifications')
 
     def get_data(self):
-        return json.loads(str(self.payload_json))
+        return orjson.loads(self.payload_json)
 
 
 class Task(db.Model):
@@ -0,0 +1,82 @@
+import atexit
+import os
+import threading
+import time
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+from app.models import User
+
+_pending = {}
+_lock = threading.Lock()
+_flusher = None
+
+
+def record_last_seen(user_id, timestamp):
+    """Queue a last_seen update, to be written by the next flush."""
+    global _flusher
+    with _lock:
+        _pending[user_id] = timestamp
+        if _flusher is None and not current_app.testing:
+            app = current_app._get_current_object()
+            _flusher = threading.Thread(target=_flush_forever, args=(app,),
+                                        daemon=True)
+            _flusher.start()
+            atexit.register(_flush_with_context, app)
+
+
+def flush_last_seen():
+    """Write all queued last_seen updates."""
+    global _pending
+    with _lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return
+    user = User.__table__
+    try:
+        if db.session.get_bind().dialect.name == 'postgresql':
+            values = sa.values(
+                sa.column('id', sa.Integer),
+                sa.column('last_seen', sa.DateTime),
+                name='v').data(list(pending.items()))
+            db.session.execute(sa.update(user).values(
+                last_seen=values.c.last_seen).where(user.c.id == values.c.id))
+        else:
+            db.session.execute(
+                sa.update(user).values(last_seen=sa.bindparam('seen')).where(
+                    user.c.id == sa.bindparam('uid')),
+                [{'uid': user_id, 'seen': timestamp}
+                 for user_id, timestamp in pending.items()])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        with _lock:
+            for user_id, timestamp in pending.items():
+                # newer times recorded since the flush started take precedence
+                _pending.setdefault(user_id, timestamp)
+        raise
+
+
+def _flush_with_context(app):
+    with app.app_context():
+        try:
+            flush_last_seen()
+        except Exception:
+            app.logger.exception('Could not save last seen times')
+
+
+def _flush_forever(app):
+    while True:
+        time.sleep(app.config['LAST_SEEN_FLUSH_INTERVAL'])
+        _flush_with_context(app)
+
+
+def _reset_after_fork():
+    # a forked worker does not inherit the flusher thread, so it starts its own
+    global _flusher, _lock
+    _flusher = None
+    _lock = threading.Lock()
+    _pending.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,16 +1,28 @@
+import hashlib
 import json
+import os
 import sys
 import time
 import sqlalchemy as sa
+import requests
 from flask import render_template
 from rq import get_current_job
+from opentimestamps.core.op import OpAppend, OpSHA256
+from opentimestamps.core.serialize import BytesDeserializationContext, \
+    StreamSerializationContext
+from opentimestamps.core.timestamp import DetachedTimestampFile, Timestamp
 from app import create_app, db
 from app.models import User, Post, Task
+from app.cache import EXPLORE_CACHE_KEY, delete_cached
 from app.email import send_email
+from app.timeline import fan_out
+from app.translate import detect_language
 
 app = create_app()
 app.app_context().push()
 
+CHUNK_SIZE = 1 << 20
+
 
 def _set_task_progress(progress):
     job = get_current_job()
@@ -54,3 +66,74 @@ def export_posts(user_id):
         app.logger.error('Unhandled exception', exc_info=sys.exc_info())
     finally:
         _set_task_progress(100)
+
+
+def fan_out_post(post_id):
+    try:
+        post = db.session.get(Post, post_id)
+        if post is not None:
+            fan_out(post)
+    except Exception:
+        app.logger.error('Unhandled exception', exc_info=sys.exc_info())
+
+
+def detect_post_language(post_id):
+    try:
+        post = db.session.get(Post, post_id)
+        if post is not None:
+            post.language = detect_language(post.body)
+            db.session.commit()
+            # the cached explore page and its ETag depend on the language
+            delete_cached(EXPLORE_CACHE_KEY)
+    except Exception:
+        app.logger.error('Unhandled exception', exc_info=sys.exc_info())
+
+
+def _submit_to_calendars(timestamp):
+    """Attach pending attestations from the OpenTimestamps calendars."""
+    # a random nonce keeps the digest of the document private
+    nonce_appended = timestamp.ops.add(OpAppend(os.urandom(16)))
+    merkle_root = nonce_appended.ops.add(OpSHA256())
+    attestations = 0
+    for url in app.config['OTS_CALENDAR_URLS']:
+        try:
+            r = requests.post(
+                url + '/digest', data=merkle_root.msg, timeout=10,
+                headers={'Accept': 'application/vnd.opentimestamps.v1'})
+            r.raise_for_status()
+            merkle_root.merge(Timestamp.deserialize(
+                BytesDeserializationContext(r.content), merkle_root.msg))
+            attestations += 1
+        except Exception:
+            app.logger.warning('Calendar %s failed', url, exc_info=True)
+    if attestations == 0:
+        raise RuntimeError('No calendar accepted the timestamp')
+
+
+def stamp_file(user_id, file_path):
+    timestamp_file_path = file_path + '.ots'
+    try:
+        _set_task_progress(0)
+        file_hash = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            while chunk := f.read(CHUNK_SIZE):
+                file_hash.update(chunk)
+        detached_timestamp = DetachedTimestampFile(
+            OpSHA256(), Timestamp(file_hash.digest()))
+        _submit_to_calendars(detached_timestamp.timestamp)
+        with open(timestamp_file_path, 'wb') as f:
+            detached_timestamp.serialize(StreamSerializationContext(f))
+    except Exception:
+        if os.path.exists(timestamp_file_path):
+            os.remove(timestamp_file_path)
+        app.logger.error('Unhandled exception', exc_info=sys.exc_info())
+        # uploads are saved as <uuid>_<filename>, one notification per upload
+        upload_id, _, filename = os.path.basename(file_path).partition('_')
+        user = db.session.get(User, user_id)
+        user.add_notification(f'stamp_failed:{upload_id}',
+                              {'filename': filename})
+        db.session.commit()
+    finally:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        _set_task_progress(100)
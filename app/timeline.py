@@ -0,0 +1,134 @@
+from datetime import timezone
+import redis
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+from app.models import Post, followers
+
+FAN_OUT_BATCH_SIZE = 1000
+CELEBRITIES_KEY = 'celebrities'
+
+# only touch timelines that are already cached, so that a partial timeline is
+# never mistaken for a complete one
+PUSH_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[3]) - 1)
+end
+'''
+
+
+def timeline_key(user_id):
+    return f'user:{user_id}:timeline'
+
+
+def _score(timestamp):
+    return timestamp.replace(tzinfo=timezone.utc).timestamp()
+
+
+def add_to_timelines(post, user_ids):
+    push = current_app.redis.register_script(PUSH_SCRIPT)
+    score = _score(post.timestamp)
+    length = current_app.config['TIMELINE_LENGTH']
+    try:
+        pipe = current_app.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            push(keys=[timeline_key(user_id)], args=[score, post.id, length],
+                 client=pipe)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+
+def celebrity_posts_key(user_id):
+    return f'celebrity_posts:{user_id}'
+
+
+def fan_out(post):
+    # posts of authors with many followers are merged in when read instead
+    if post.author.followers_count() > \
+            current_app.config['TIMELINE_FAN_OUT_LIMIT']:
+        key = celebrity_posts_key(post.user_id)
+        try:
+            pipe = current_app.redis.pipeline()
+            pipe.sadd(CELEBRITIES_KEY, post.user_id)
+            pipe.zadd(key, {post.id: _score(post.timestamp)})
+            pipe.zremrangebyrank(
+                key, 0, -current_app.config['TIMELINE_LENGTH'] - 1)
+            pipe.execute()
+        except redis.exceptions.RedisError:
+            pass
+        return
+    query = sa.select(followers.c.follower_id).where(
+        followers.c.followed_id == post.user_id).execution_options(
+            yield_per=FAN_OUT_BATCH_SIZE)
+    for user_ids in db.session.scalars(query).partitions():
+        add_to_timelines(post, user_ids)
+
+
+def remove_timeline(user_id):
+    try:
+        current_app.redis.delete(timeline_key(user_id))
+    except redis.exceptions.RedisError:
+        pass
+
+
+def _load_timeline(user):
+    query = user.following_posts().with_only_columns(
+        Post.id, Post.timestamp).order_by(None).order_by(
+            Post.timestamp.desc(), Post.id.desc()).limit(
+                current_app.config['TIMELINE_LENGTH'])
+    entries = {id: _score(timestamp)
+               for id, timestamp in db.session.execute(query)}
+    if entries:
+        pipe = current_app.redis.pipeline()
+        pipe.delete(timeline_key(user.id))
+        pipe.zadd(timeline_key(user.id), entries)
+        pipe.expire(timeline_key(user.id),
+                    current_app.config['TIMELINE_TIMEOUT'])
+        pipe.execute()
+    return len(entries)
+
+
+def _followed_celebrities(user):
+    celebrities = [int(id) for id in
+                   current_app.redis.smembers(CELEBRITIES_KEY)]
+    if not celebrities:
+        return []
+    return db.session.scalars(sa.select(followers.c.followed_id).where(
+        followers.c.follower_id == user.id,
+        followers.c.followed_id.in_(celebrities))).all()
+
+
+def get_timeline_page(user, per_page, before=None):
+    # returns None when the cached timeline does not cover the page
+    key = timeline_key(user.id)
+    max_score = '+inf' if before is None else _score(before[0])
+    try:
+        length = current_app.redis.zcard(key) or _load_timeline(user)
+        pipe = current_app.redis.pipeline(transaction=False)
+        for k in [key] + [celebrity_posts_key(id)
+                          for id in _followed_celebrities(user)]:
+            pipe.zrevrangebyscore(k, max_score, '-inf', start=0,
+                                  num=per_page + 2, withscores=True)
+        results = pipe.execute()
+    except redis.exceptions.RedisError:
+        return None
+    # posts of followed celebrities are merged in, dropping any that were
+    # also loaded into the timeline from the database
+    entries = sorted({(score, int(id)) for result in results
+                      for id, score in result}, reverse=True)
+    if before is not None:
+        before = (_score(before[0]), before[1])
+        entries = [entry for entry in entries if entry < before]
+    has_next = len(entries) > per_page
+    if not has_next and length >= current_app.config['TIMELINE_LENGTH']:
+        # older posts may have been trimmed from the cached timeline
+        return None
+    posts = Post.get_many([id for score, id in entries[:per_page]])
+    if not posts:
+        return posts, None, None
+    next_cursor = (posts[-1].timestamp, posts[-1].id) if has_next else None
+    prev_cursor = (posts[0].timestamp, posts[0].id) \
+        if before is not None else None
+    return posts, next_cursor, prev_cursor
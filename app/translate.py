@@ -1,6 +1,9 @@
 import requests
 from flask import current_app
 from flask_babel import _
+from langdetect import detect, DetectorFactory, LangDetectException
+
+DetectorFactory.seed = 0
 
 
 def translate(text, source_language, dest_language):
@@ -19,3 +22,15 @@ def translate(text, source_language, dest_language):
     if r.status_code != 200:
         return _('Error: the translation service failed.')
     return r.json()[0]['translations'][0]['text']
+
+
+def detect_language(text):
+    try:
+        return detect(text)
+    except LangDetectException:
+        return ''
+
+
+def warm_up_language_detection():
+    """Load the language profiles now instead of on the first detection."""
+    detect('hello world')
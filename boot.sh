@@ -8,4 +8,4 @@ while true; do
     echo Deploy command failed, retrying in 5 secs...
     sleep 5
 done
-exec gunicorn -b :5000 --access-logfile - --error-logfile - microblog:app
+exec gunicorn -c gunicorn.conf.py --preload -b :5000 --access-logfile - --error-logfile - microblog:app
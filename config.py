@@ -10,6 +10,9 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', '').replace(
         'postgres://', 'postgresql://') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
+    SQLALCHEMY_ENGINE_OPTIONS = {'pool_pre_ping': True, 'pool_recycle': 300}
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE') or 10)
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW') or 20)
     LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT')
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
@@ -21,4 +24,16 @@ class Config:
     MS_TRANSLATOR_KEY = os.environ.get('MS_TRANSLATOR_KEY')
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL')
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://'
+    STAMP_FOLDER = os.environ.get('STAMP_FOLDER') or \
+        os.path.join(basedir, 'stamps')
+    STAMP_TIMEOUT = int(os.environ.get('STAMP_TIMEOUT') or 7 * 24 * 3600)
+    OTS_CALENDAR_URLS = (os.environ.get('OTS_CALENDAR_URLS') or
+                         'https://a.pool.opentimestamps.org,'
+                         'https://b.pool.opentimestamps.org').split(',')
     POSTS_PER_PAGE = 25
+    LAST_SEEN_UPDATE_INTERVAL = 60
+    LAST_SEEN_FLUSH_INTERVAL = 15
+    EXPLORE_CACHE_TIMEOUT = 45
+    TIMELINE_LENGTH = 1000
+    TIMELINE_TIMEOUT = 3600
+    TIMELINE_FAN_OUT_LIMIT = 10000
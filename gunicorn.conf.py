@@ -0,0 +1,11 @@
+# gunicorn settings, used by boot.sh, the Procfile and the supervisor config
+from gevent import monkey
+from psycogreen.gevent import patch_psycopg
+
+# patch before the application is preloaded, so that the modules it imports
+# (ssl in particular) are patched too, and make psycopg2 yield to other
+# greenlets while it waits on the database instead of blocking the worker
+monkey.patch_all()
+patch_psycopg()
+
+worker_class = 'gevent'
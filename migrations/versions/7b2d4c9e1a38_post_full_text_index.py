@@ -0,0 +1,31 @@
+"""post full text index
+
+Revision ID: 7b2d4c9e1a38
+Revises: a3c95d1e7f60
+Create Date: 2026-10-15 19:31:08.664021
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b2d4c9e1a38'
+down_revision = 'a3c95d1e7f60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # full-text search without Elasticsearch is only available on PostgreSQL
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.create_index('ix_post_body_tsv', 'post',
+                    [sa.text("to_tsvector('english', body)")],
+                    postgresql_using='gin')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_post_body_tsv', table_name='post')
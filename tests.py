@@ -3,6 +3,7 @@ from datetime import datetime, timezone, timedelta
 import unittest
 from app import create_app, db
 from app.models import User, Post
+from app.presence import record_last_seen, flush_last_seen
 from config import Config
 
 
@@ -63,6 +64,25 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(u1.following_count(), 0)
         self.assertEqual(u2.followers_count(), 0)
 
+    def test_follow_username(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        self.assertTrue(u1.follow_username('susan'))
+        self.assertFalse(u1.follow_username('susan'))
+        self.assertFalse(u1.follow_username('mary'))
+        db.session.commit()
+        self.assertTrue(u1.is_following(u2))
+        self.assertEqual(u2.followers_count(), 1)
+
+        self.assertTrue(u1.unfollow_username('susan'))
+        self.assertFalse(u1.unfollow_username('susan'))
+        self.assertFalse(u1.unfollow_username('mary'))
+        db.session.commit()
+        self.assertFalse(u1.is_following(u2))
+
     def test_follow_posts(self):
         # create four users
         u1 = User(username='john', email='john@example.com')
@@ -101,6 +121,87 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(f3, [p3, p4])
         self.assertEqual(f4, [p4])
 
+    def test_flush_last_seen(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        seen = datetime(2030, 1, 1, 12, 0)
+        record_last_seen(u1.id, seen)
+        record_last_seen(u2.id, seen - timedelta(hours=1))
+        record_last_seen(u2.id, seen)
+        record_last_seen(u2.id + 100, seen)
+        flush_last_seen()
+        db.session.expire_all()
+        self.assertEqual(u1.last_seen, seen)
+        self.assertEqual(u2.last_seen, seen)
+
+    def test_add_notification(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+
+        u.add_notification('unread_message_count', 1)
+        u.add_notification('unread_message_count', 2)
+        db.session.commit()
+        notifications = db.session.scalars(u.notifications.select()).all()
+        self.assertEqual(len(notifications), 1)
+        self.assertEqual(notifications[0].name, 'unread_message_count')
+        self.assertEqual(notifications[0].get_data(), 2)
+
+    def test_unread_count(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        self.assertEqual(u.unread_message_count(), 0)
+
+        u.unread_count = User.unread_count + 1
+        db.session.flush()
+        self.assertEqual(u.unread_count, 1)
+        u.unread_count = User.unread_count + 1
+        db.session.commit()
+        db.session.expire_all()
+        self.assertEqual(u.unread_message_count(), 2)
+
+        u.unread_count = 0
+        db.session.commit()
+        db.session.expire_all()
+        self.assertEqual(u.unread_message_count(), 0)
+
+    def test_keyset_paginate(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        now = datetime.now(timezone.utc)
+        # posts 1 to 3 share a timestamp, so the id breaks the tie
+        offsets = [0, 1, 1, 1, 2, 3]
+        posts = [Post(body=f'post {i}', author=u,
+                      timestamp=now - timedelta(seconds=offset))
+                 for i, offset in enumerate(offsets)]
+        db.session.add_all(posts)
+        db.session.commit()
+        posts.sort(key=lambda p: (p.timestamp, p.id), reverse=True)
+        query = u.posts.select()
+
+        pages = []
+        items, next_cursor, prev_cursor = Post.keyset_paginate(query, 2)
+        self.assertIsNone(prev_cursor)
+        pages.append(items)
+        while next_cursor is not None:
+            items, next_cursor, prev_cursor = Post.keyset_paginate(
+                query, 2, before=next_cursor)
+            pages.append(items)
+        self.assertEqual(len(pages), 3)
+        self.assertEqual([p for page in pages for p in page], posts)
+
+        back = []
+        while prev_cursor is not None:
+            items, next_cursor, prev_cursor = Post.keyset_paginate(
+                query, 2, after=prev_cursor)
+            self.assertIsNotNone(next_cursor)
+            back = items + back
+        self.assertEqual(back + pages[-1], posts)
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,10 @@
+from rq import Worker
+from app.tasks import app
+from app.translate import warm_up_language_detection
+
+# load the application and the language profiles once in the worker process,
+# so that the work-horse forked for each job inherits them
+warm_up_language_detection()
+
+if __name__ == '__main__':
+    Worker([app.task_queue], connection=app.redis).work()